@@ -1,41 +1,47 @@
 """
 Velvet Research - Configuration
 """
-import os
-from pydantic_settings import BaseSettings
+from functools import lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_file=".env", frozen=True)
+
     # JWT
-    jwt_secret: str = os.getenv("JWT_SECRET", "dev-secret-change-in-production")
+    jwt_secret: str = "dev-secret-change-in-production"
     jwt_algorithm: str = "HS256"
     jwt_expiration_hours: int = 24
 
+    # Password hashing (each bcrypt round doubles the work)
+    bcrypt_rounds: int = 10
+
     # Database
-    database_url: str = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./velvet.db")
+    database_url: str = "sqlite+aiosqlite:///./velvet.db"
 
     # File storage
-    upload_dir: str = os.getenv("UPLOAD_DIR", "/tmp/velvet_uploads")
-    report_dir: str = os.getenv("REPORT_DIR", "/tmp/velvet_reports")
+    upload_dir: str = "/tmp/velvet_uploads"
+    report_dir: str = "/tmp/velvet_reports"
     max_file_size_mb: int = 50
     max_upload_size_mb: int = 100
-    allowed_extensions: set = {".csv", ".xlsx", ".xls", ".docx", ".pdf", ".txt"}
+    allowed_extensions: frozenset = frozenset({".csv", ".xlsx", ".xls", ".docx", ".pdf", ".txt"})
 
     # API
-    anthropic_api_key: str = os.getenv("ANTHROPIC_API_KEY", "")
+    anthropic_api_key: str = ""
 
     # Science Wizard project path
-    science_wizard_path: str = os.getenv(
-        "SCIENCE_WIZARD_PATH",
-        "/Users/vafabayat/Dropbox/Financial/0ScienceWizard/science_wizard_project"
-    )
+    science_wizard_path: str = "/Users/vafabayat/Dropbox/Financial/0ScienceWizard/science_wizard_project"
 
     # Server
-    port: int = int(os.getenv("PORT", 8000))
-    debug: bool = os.getenv("DEBUG", "false").lower() == "true"
+    port: int = 8000
+    debug: bool = False
+    cors_origins: tuple = ("*",)
+
 
-    class Config:
-        env_file = ".env"
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Parse settings once; env vars and .env are read on first call only."""
+    return Settings()
 
 
-settings = Settings()
+settings = get_settings()
@@ -1,17 +1,91 @@
 """
 Velvet Research - Database Models and Setup
 """
+import asyncio
 import aiosqlite
-from datetime import datetime
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from pathlib import Path
 from config import settings
 
 DATABASE_PATH = Path(settings.database_url.replace("sqlite+aiosqlite:///", ""))
 
 
+def _now_iso() -> str:
+    """UTC timestamp for created_at/updated_at columns.
+
+    datetime.utcnow() is deprecated in 3.12; call this once per operation
+    and reuse the value across statements.
+    """
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+# Connection pool (filled by init_pool during app startup)
+POOL_SIZE = 8
+_pool: asyncio.Queue = None
+
+_CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+]
+
+
+async def _open_connection():
+    """Open a configured connection for the pool."""
+    # Generous statement cache so repeated endpoint SQL skips re-parsing
+    db = await aiosqlite.connect(DATABASE_PATH, cached_statements=512)
+    db.row_factory = aiosqlite.Row
+    for pragma in _CONNECTION_PRAGMAS:
+        await db.execute(pragma)
+    await db.commit()
+    return db
+
+
+async def init_pool(size: int = POOL_SIZE):
+    """Pre-open a bounded pool of connections (called from lifespan)."""
+    global _pool
+    _pool = asyncio.Queue()
+    for _ in range(size):
+        await _pool.put(await _open_connection())
+
+
+async def close_pool():
+    """Close all pooled connections (called on shutdown)."""
+    global _pool
+    if _pool is None:
+        return
+    while not _pool.empty():
+        db = _pool.get_nowait()
+        await db.close()
+    _pool = None
+
+
+# Bump when tables/indexes below change so init_db re-runs the CREATEs
+SCHEMA_VERSION = 2
+
+
 async def init_db():
     """Initialize database tables."""
     async with aiosqlite.connect(DATABASE_PATH) as db:
+        # Fast path: schema already provisioned at the current revision
+        cursor = await db.execute("PRAGMA user_version")
+        (version,) = await cursor.fetchone()
+        if version == SCHEMA_VERSION:
+            return
+
+        # WAL lets status polls read while a background job writes;
+        # NORMAL sync drops the per-commit fsync to batched group commits
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("PRAGMA synchronous=NORMAL")
+        await db.execute("PRAGMA wal_autocheckpoint=1000")
+        await db.execute("PRAGMA busy_timeout=5000")
+        await db.execute("PRAGMA foreign_keys=ON")
+
         # Users table
         await db.execute("""
             CREATE TABLE IF NOT EXISTS users (
@@ -35,6 +109,21 @@ async def init_db():
             )
         """)
 
+        # Per-file upload rows (replaces parsing the uploads.files JSON
+        # blob on every read; the blob is kept for one release for compat)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS upload_files (
+                upload_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                type TEXT,
+                path TEXT,
+                PRIMARY KEY (upload_id, idx),
+                FOREIGN KEY (upload_id) REFERENCES uploads(id)
+            )
+        """)
+
         # Jobs table
         await db.execute("""
             CREATE TABLE IF NOT EXISTS jobs (
@@ -103,30 +192,82 @@ async def init_db():
             )
         """)
 
+        # Indexes for hot lookups (referral_code and email are already
+        # covered by their UNIQUE constraints)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_created ON jobs(user_id, created_at DESC)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_uploads_user ON uploads(user_id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_token_tx_user_created ON token_transactions(user_id, created_at DESC)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals(referrer_user_id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_feedback_job ON feedback(job_id)")
+
+        # Backfill per-file rows for uploads that predate upload_files
+        # (v0/v1 databases only have the uploads.files JSON blob)
+        if version < 2:
+            import json
+            cursor = await db.execute(
+                """SELECT id, files FROM uploads
+                   WHERE id NOT IN (SELECT DISTINCT upload_id FROM upload_files)"""
+            )
+            for upload_id, files_blob in await cursor.fetchall():
+                try:
+                    file_list = json.loads(files_blob)
+                except (TypeError, ValueError):
+                    continue
+                await db.executemany(
+                    "INSERT OR IGNORE INTO upload_files (upload_id, idx, filename, size, type, path) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (upload_id, idx, f.get("name", ""), f.get("size", 0), f.get("type"), f.get("path"))
+                        for idx, f in enumerate(file_list)
+                        if isinstance(f, dict)
+                    ]
+                )
+
+        await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         await db.commit()
 
 
+@asynccontextmanager
 async def get_db():
-    """Get database connection."""
-    db = await aiosqlite.connect(DATABASE_PATH)
-    db.row_factory = aiosqlite.Row
+    """Acquire a database connection from the pool."""
+    if _pool is None:
+        # Fallback for scripts/tests running outside the app lifespan
+        db = await _open_connection()
+        try:
+            yield db
+        finally:
+            await db.close()
+        return
+
+    db = await _pool.get()
     try:
         yield db
     finally:
-        await db.close()
+        # A write that failed mid-transaction (e.g. an IntegrityError the
+        # caller handles) must not re-pool the connection still holding
+        # the WAL write lock — that wedges every other writer
+        if db.in_transaction:
+            await db.rollback()
+        await _pool.put(db)
 
 
 # User operations
 async def create_user(db, user_id: str, email: str, password_hash: str):
-    await db.execute(
-        "INSERT INTO users (id, email, password_hash, created_at) VALUES (?, ?, ?, ?)",
-        (user_id, email, password_hash, datetime.utcnow().isoformat())
+    # RETURNING hands back the created row, saving a follow-up SELECT;
+    # a duplicate email surfaces as sqlite3.IntegrityError
+    cursor = await db.execute(
+        "INSERT INTO users (id, email, password_hash, created_at) VALUES (?, ?, ?, ?) RETURNING id, email, created_at",
+        (user_id, email, password_hash, _now_iso())
     )
+    row = await cursor.fetchone()
     await db.commit()
+    return row
 
 
 async def get_user_by_email(db, email: str):
-    cursor = await db.execute("SELECT * FROM users WHERE email = ?", (email,))
+    cursor = await db.execute(
+        "SELECT id, email, password_hash, created_at FROM users WHERE email = ?",
+        (email,)
+    )
     return await cursor.fetchone()
 
 
@@ -136,10 +277,18 @@ async def get_user_by_id(db, user_id: str):
 
 
 # Upload operations
-async def create_upload(db, upload_id: str, user_id: str, files: str, upload_path: str):
+async def create_upload(db, upload_id: str, user_id: str, file_list: list, upload_path: str):
+    import json
     await db.execute(
         "INSERT INTO uploads (id, user_id, files, upload_path, created_at) VALUES (?, ?, ?, ?, ?)",
-        (upload_id, user_id, files, upload_path, datetime.utcnow().isoformat())
+        (upload_id, user_id, json.dumps(file_list), upload_path, _now_iso())
+    )
+    await db.executemany(
+        "INSERT INTO upload_files (upload_id, idx, filename, size, type, path) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (upload_id, idx, f["name"], f["size"], f.get("type"), f.get("path"))
+            for idx, f in enumerate(file_list)
+        ]
     )
     await db.commit()
 
@@ -149,35 +298,53 @@ async def get_upload(db, upload_id: str):
     return await cursor.fetchone()
 
 
+async def get_upload_file_rows(db, upload_id: str):
+    cursor = await db.execute(
+        "SELECT filename, size, type, path FROM upload_files WHERE upload_id = ? ORDER BY idx",
+        (upload_id,)
+    )
+    return await cursor.fetchall()
+
+
 # Job operations
 async def create_job(db, job_id: str, user_id: str, upload_id: str):
     await db.execute(
         "INSERT INTO jobs (id, user_id, upload_id, status, created_at) VALUES (?, ?, ?, 'pending', ?)",
-        (job_id, user_id, upload_id, datetime.utcnow().isoformat())
+        (job_id, user_id, upload_id, _now_iso())
     )
     await db.commit()
 
 
+# Prebuilt UPDATE statements for every field combination so sqlite3's
+# statement cache can reuse the prepared plan instead of re-parsing the
+# dynamically assembled SQL on each call
+_JOB_UPDATE_FIELDS = ("progress", "error", "report_path", "completed_at")
+
+
+def _build_job_update_sql():
+    from itertools import combinations
+    sql = {}
+    for r in range(len(_JOB_UPDATE_FIELDS) + 1):
+        for combo in combinations(_JOB_UPDATE_FIELDS, r):
+            columns = ["status = ?"] + [f"{col} = ?" for col in combo]
+            sql[combo] = f"UPDATE jobs SET {', '.join(columns)} WHERE id = ?"
+    return sql
+
+
+_JOB_UPDATE_SQL = _build_job_update_sql()
+
+
 async def update_job_status(db, job_id: str, status: str, progress: float = None,
                             error: str = None, report_path: str = None):
-    updates = ["status = ?"]
-    params = [status]
-
-    if progress is not None:
-        updates.append("progress = ?")
-        params.append(progress)
-    if error is not None:
-        updates.append("error = ?")
-        params.append(error)
-    if report_path is not None:
-        updates.append("report_path = ?")
-        params.append(report_path)
-    if status == "completed" or status == "failed":
-        updates.append("completed_at = ?")
-        params.append(datetime.utcnow().isoformat())
-
-    params.append(job_id)
-    await db.execute(f"UPDATE jobs SET {', '.join(updates)} WHERE id = ?", params)
+    values = {
+        "progress": progress,
+        "error": error,
+        "report_path": report_path,
+        "completed_at": _now_iso() if status in ("completed", "failed") else None,
+    }
+    combo = tuple(f for f in _JOB_UPDATE_FIELDS if values[f] is not None)
+    params = [status] + [values[f] for f in combo] + [job_id]
+    await db.execute(_JOB_UPDATE_SQL[combo], params)
     await db.commit()
 
 
@@ -186,10 +353,13 @@ async def get_job(db, job_id: str):
     return await cursor.fetchone()
 
 
-async def get_user_jobs(db, user_id: str):
+async def get_user_jobs(db, user_id: str, limit: int = 100):
+    # Project only the columns the job list renders; error/report_path
+    # can be large and are served by the per-job status endpoint
     cursor = await db.execute(
-        "SELECT * FROM jobs WHERE user_id = ? ORDER BY created_at DESC",
-        (user_id,)
+        """SELECT id, status, progress, created_at, completed_at
+           FROM jobs WHERE user_id = ? ORDER BY created_at DESC LIMIT ?""",
+        (user_id, limit)
     )
     return await cursor.fetchall()
 
@@ -204,51 +374,69 @@ async def get_user_tokens(db, user_id: str):
         # Create initial token balance
         await db.execute(
             "INSERT INTO user_tokens (user_id, balance, total_purchased, last_updated) VALUES (?, 0, 0, ?)",
-            (user_id, datetime.utcnow().isoformat())
+            (user_id, _now_iso())
         )
         await db.commit()
         return {"user_id": user_id, "balance": 0, "total_purchased": 0}
 
 
 async def add_tokens(db, user_id: str, amount: int, transaction_type: str, description: str):
-    # Add token transaction
+    # Transaction log and balance update in one transaction / one fsync
     import uuid
     transaction_id = str(uuid.uuid4())
-    await db.execute(
-        "INSERT INTO token_transactions (id, user_id, type, amount, description, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-        (transaction_id, user_id, transaction_type, amount, description, datetime.utcnow().isoformat())
-    )
-
-    # Update user balance
-    await db.execute(
-        "UPDATE user_tokens SET balance = balance + ?, last_updated = ? WHERE user_id = ?",
-        (amount, datetime.utcnow().isoformat(), user_id)
-    )
-
-    # Update total purchased if it's a purchase
-    if transaction_type == "purchase":
+    now = _now_iso()
+    await db.execute("BEGIN IMMEDIATE")
+    try:
         await db.execute(
-            "UPDATE user_tokens SET total_purchased = total_purchased + ? WHERE user_id = ?",
-            (amount, user_id)
+            "INSERT INTO token_transactions (id, user_id, type, amount, description, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (transaction_id, user_id, transaction_type, amount, description, now)
         )
-
-    await db.commit()
+        await db.execute(
+            """UPDATE user_tokens
+               SET balance = balance + ?,
+                   total_purchased = total_purchased + CASE WHEN ? = 'purchase' THEN ? ELSE 0 END,
+                   last_updated = ?
+               WHERE user_id = ?""",
+            (amount, transaction_type, amount, now, user_id)
+        )
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
 
 
 async def consume_tokens(db, user_id: str, amount: int, description: str):
-    # Check if user has enough tokens
-    user_tokens = await get_user_tokens(db, user_id)
-    if user_tokens["balance"] < amount:
-        return False
+    # Ensure the balance row exists (auto-creates for new users)
+    await get_user_tokens(db, user_id)
 
-    # Deduct tokens
-    await add_tokens(db, user_id, -amount, "consumption", description)
+    # Check and debit atomically so concurrent consumes can't overdraw
+    import uuid
+    now = _now_iso()
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = await db.execute(
+            "UPDATE user_tokens SET balance = balance - ?, last_updated = ? WHERE user_id = ? AND balance >= ?",
+            (amount, now, user_id, amount)
+        )
+        if cursor.rowcount == 0:
+            await db.rollback()
+            return False
+
+        await db.execute(
+            "INSERT INTO token_transactions (id, user_id, type, amount, description, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (str(uuid.uuid4()), user_id, "consumption", -amount, description, now)
+        )
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
     return True
 
 
 async def get_token_transactions(db, user_id: str, limit: int = 20):
     cursor = await db.execute(
-        "SELECT * FROM token_transactions WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+        """SELECT id, type, amount, description, created_at
+           FROM token_transactions WHERE user_id = ? ORDER BY created_at DESC LIMIT ?""",
         (user_id, limit)
     )
     return await cursor.fetchall()
@@ -259,8 +447,9 @@ async def create_referral(db, referrer_user_id: str, referral_code: str):
     import uuid
     referral_id = str(uuid.uuid4())
     await db.execute(
-        "INSERT INTO referrals (id, referrer_user_id, referral_code, created_at) VALUES (?, ?, ?, ?)",
-        (referral_id, referrer_user_id, referral_code, datetime.utcnow().isoformat())
+        """INSERT INTO referrals (id, referrer_user_id, referral_code, created_at) VALUES (?, ?, ?, ?)
+           ON CONFLICT(referral_code) DO NOTHING""",
+        (referral_id, referrer_user_id, referral_code, _now_iso())
     )
     await db.commit()
     return referral_id
@@ -271,6 +460,17 @@ async def get_referral_by_code(db, referral_code: str):
     return await cursor.fetchone()
 
 
+async def get_referral_with_referrer(db, referral_code: str):
+    # One JOIN instead of referral lookup + separate user SELECT
+    cursor = await db.execute(
+        """SELECT r.*, u.email AS referrer_email
+           FROM referrals r JOIN users u ON u.id = r.referrer_user_id
+           WHERE r.referral_code = ?""",
+        (referral_code,)
+    )
+    return await cursor.fetchone()
+
+
 async def get_user_referral_code(db, user_id: str):
     cursor = await db.execute("SELECT referral_code FROM referrals WHERE referrer_user_id = ? LIMIT 1", (user_id,))
     return await cursor.fetchone()
@@ -304,21 +504,35 @@ async def award_referral_tokens(db, referral_code: str):
 
 
 async def send_referral_invitation(db, referrer_user_id: str, referee_email: str):
-    # Get or create referral code for user
-    referral = await get_user_referral_code(db, referrer_user_id)
-    if not referral:
-        # Generate new referral code
-        import random, string
-        referral_code = f"VR-{referrer_user_id[:3].upper()}{random.randint(100, 999)}"
-        await create_referral(db, referrer_user_id, referral_code)
-    else:
-        referral_code = referral["referral_code"]
+    import uuid
+    import secrets
 
-    # Record the email invitation
-    await db.execute(
-        "UPDATE referrals SET referee_email = ? WHERE referral_code = ?",
-        (referee_email, referral_code)
-    )
-    await db.commit()
+    # Candidate code with enough entropy that collisions are not a concern
+    candidate_code = f"VR-{referrer_user_id[:3].upper()}{secrets.token_hex(4).upper()}"
+    now = _now_iso()
+
+    # Claim-or-keep the user's code, record the invitation and read the
+    # final code back in one transaction — no SELECT-then-INSERT race
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        await db.execute(
+            """INSERT INTO referrals (id, referrer_user_id, referral_code, created_at)
+               SELECT ?, ?, ?, ?
+               WHERE NOT EXISTS (SELECT 1 FROM referrals WHERE referrer_user_id = ?)""",
+            (str(uuid.uuid4()), referrer_user_id, candidate_code, now, referrer_user_id)
+        )
+        await db.execute(
+            "UPDATE referrals SET referee_email = ? WHERE referrer_user_id = ?",
+            (referee_email, referrer_user_id)
+        )
+        cursor = await db.execute(
+            "SELECT referral_code FROM referrals WHERE referrer_user_id = ? LIMIT 1",
+            (referrer_user_id,)
+        )
+        row = await cursor.fetchone()
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
 
-    return referral_code
+    return row["referral_code"]
@@ -5,24 +5,26 @@ Phase 1-3 Implementation for Render Professional
 """
 import os
 import sys
-import uuid
-import json
+import orjson
+import secrets
 import asyncio
+import sqlite3
 from pathlib import Path
 from contextlib import asynccontextmanager
 from typing import List, Optional
 
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 
 from config import settings
 from database import (
-    init_db, get_db,
+    init_db, init_pool, close_pool, get_db,
     create_user, get_user_by_email, get_user_by_id,
-    create_upload, get_upload,
+    create_upload, get_upload, get_upload_file_rows,
     create_job, update_job_status, get_job, get_user_jobs,
     get_user_tokens, add_tokens, consume_tokens, get_token_transactions,
     create_referral, get_referral_by_code, get_user_referral_code,
@@ -30,46 +32,71 @@ from database import (
 )
 from services.auth import (
     UserCreate, UserLogin, UserResponse, TokenResponse,
-    hash_password, verify_password, create_access_token,
-    get_current_user, generate_user_id
+    hash_password, verify_password,
+    hash_password_async, verify_password_async, verify_against_dummy,
+    shutdown_bcrypt_executor,
+    create_access_token, get_current_user, generate_user_id
 )
-from services.upload import save_uploaded_files, get_upload_files
-from services.report_generator import run_generation_job, get_job_progress
+# services.upload and services.report_generator are imported lazily inside
+# their endpoints — they transitively pull aiofiles, the Anthropic SDK,
+# python-docx and openpyxl, which would otherwise inflate cold-start time
 
 
 # Lifespan for startup/shutdown
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
+    # Startup — upload/report dirs are created on first use, not here
     await init_db()
-    Path(settings.upload_dir).mkdir(parents=True, exist_ok=True)
-    Path(settings.report_dir).mkdir(parents=True, exist_ok=True)
+    await init_pool()
     yield
-    # Shutdown
+    # Shutdown — only touch the job workers if the module ever loaded
+    report_generator = sys.modules.get("services.report_generator")
+    if report_generator is not None:
+        await report_generator.stop_job_workers()
+    await close_pool()
+    shutdown_bcrypt_executor()
 
 
 app = FastAPI(
     title="Velvet Research",
     description="AI-Powered Research Manuscript Generation",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # orjson is a C-backed encoder, 3-10x faster than stdlib json
+    default_response_class=ORJSONResponse
 )
 
-# CORS middleware
+# CORS middleware — origins come from config so deployments can pin a
+# concrete list; credentials with a wildcard origin is invalid per spec
+# and forces Starlette to echo origins per request
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=list(settings.cors_origins),
+    allow_credentials="*" not in settings.cors_origins,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# Compress larger JSON responses (e.g. /api/jobs)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Static files
 BASE_DIR = Path(__file__).parent
 STATIC_DIR = BASE_DIR / "static"
 
-app.mount("/css", StaticFiles(directory=STATIC_DIR / "css"), name="css")
-app.mount("/js", StaticFiles(directory=STATIC_DIR / "js"), name="js")
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that tells browsers to cache assets long-term."""
+
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code == 200:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
+app.mount("/css", CachedStaticFiles(directory=STATIC_DIR / "css"), name="css")
+app.mount("/js", CachedStaticFiles(directory=STATIC_DIR / "js"), name="js")
 
 
 # ============================================================================
@@ -107,23 +134,22 @@ async def health():
 @app.post("/api/auth/register", response_model=TokenResponse)
 async def register(user_data: UserCreate):
     """Register a new user."""
-    async for db in get_db():
-        # Check if email exists
-        existing = await get_user_by_email(db, user_data.email)
-        if existing:
-            raise HTTPException(status_code=400, detail="Email already registered")
+    # bcrypt is CPU-bound — run it in the hashing process pool
+    password_hash = await hash_password_async(user_data.password)
 
-        # Create user
+    async with get_db() as db:
         user_id = generate_user_id()
-        password_hash = hash_password(user_data.password)
-        await create_user(db, user_id, user_data.email, password_hash)
+
+        # Single INSERT ... RETURNING; the UNIQUE(email) constraint
+        # replaces the old SELECT-then-INSERT existence check
+        try:
+            user = await create_user(db, user_id, user_data.email, password_hash)
+        except sqlite3.IntegrityError:
+            raise HTTPException(status_code=400, detail="Email already registered")
 
         # Generate token
         token = create_access_token(user_id, user_data.email)
 
-        # Get user for response
-        user = await get_user_by_id(db, user_id)
-
         return TokenResponse(
             access_token=token,
             user=UserResponse(
@@ -137,10 +163,14 @@ async def register(user_data: UserCreate):
 @app.post("/api/auth/login", response_model=TokenResponse)
 async def login(credentials: UserLogin):
     """Login and get access token."""
-    async for db in get_db():
+    async with get_db() as db:
         user = await get_user_by_email(db, credentials.email)
 
-        if not user or not verify_password(credentials.password, user["password_hash"]):
+        if user is not None:
+            valid = await verify_password_async(credentials.password, user["password_hash"])
+        else:
+            valid = await verify_against_dummy(credentials.password)
+        if not valid:
             raise HTTPException(
                 status_code=401,
                 detail="Invalid email or password"
@@ -161,7 +191,7 @@ async def login(credentials: UserLogin):
 @app.get("/api/auth/me", response_model=UserResponse)
 async def get_me(current_user: dict = Depends(get_current_user)):
     """Get current user info."""
-    async for db in get_db():
+    async with get_db() as db:
         user = await get_user_by_id(db, current_user["id"])
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
@@ -188,6 +218,8 @@ async def upload_files(
     current_user: dict = Depends(get_current_user)
 ):
     """Upload research files."""
+    from services.upload import save_uploaded_files
+
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
 
@@ -197,8 +229,8 @@ async def upload_files(
     )
 
     # Save to database
-    async for db in get_db():
-        await create_upload(db, upload_id, current_user["id"], json.dumps(file_list), upload_path)
+    async with get_db() as db:
+        await create_upload(db, upload_id, current_user["id"], file_list, upload_path)
 
     return UploadResponse(upload_id=upload_id, files=file_list)
 
@@ -209,7 +241,7 @@ async def get_upload_info(
     current_user: dict = Depends(get_current_user)
 ):
     """Get upload info."""
-    async for db in get_db():
+    async with get_db() as db:
         upload = await get_upload(db, upload_id)
 
         if not upload:
@@ -218,9 +250,14 @@ async def get_upload_info(
         if upload["user_id"] != current_user["id"]:
             raise HTTPException(status_code=403, detail="Not authorized")
 
+        file_rows = await get_upload_file_rows(db, upload_id)
+
         return {
             "upload_id": upload["id"],
-            "files": json.loads(upload["files"]),
+            "files": [
+                {"name": f["filename"], "size": f["size"], "type": f["type"], "path": f["path"]}
+                for f in file_rows
+            ],
             "created_at": upload["created_at"]
         }
 
@@ -229,6 +266,16 @@ async def get_upload_info(
 # Report Generation Endpoints
 # ============================================================================
 
+async def _persist_job_update(jid, status, progress, error=None, report_path=None):
+    """Write a job update to the jobs table.
+
+    Progress-tick debouncing lives in run_generation_job — by the time a
+    call reaches here it's a checkpoint worth persisting.
+    """
+    async with get_db() as db:
+        await update_job_status(db, jid, status, progress, error, report_path)
+
+
 class GenerateRequest(BaseModel):
     upload_id: str
     project_type: Optional[str] = "manuscript"
@@ -245,14 +292,22 @@ class JobResponse(BaseModel):
 @app.post("/api/generate", response_model=JobResponse)
 async def generate_report(
     request: GenerateRequest,
-    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user)
 ):
     """Start report generation job."""
-    async for db in get_db():
-        # Verify upload exists and belongs to user
-        upload = await get_upload(db, request.upload_id)
+    from services.report_generator import enqueue_generation_job
 
+    async with get_db() as db:
+        job_id = secrets.token_hex(16)
+        output_dir = Path(settings.report_dir) / current_user["id"] / job_id
+
+        # Fetch the upload while the (blocking) mkdir runs in a thread
+        upload, _ = await asyncio.gather(
+            get_upload(db, request.upload_id),
+            asyncio.to_thread(output_dir.mkdir, parents=True, exist_ok=True)
+        )
+
+        # Verify upload exists and belongs to user
         if not upload:
             raise HTTPException(status_code=404, detail="Upload not found")
 
@@ -260,25 +315,14 @@ async def generate_report(
             raise HTTPException(status_code=403, detail="Not authorized")
 
         # Create job
-        job_id = str(uuid.uuid4())
         await create_job(db, job_id, current_user["id"], request.upload_id)
 
-        # Output directory
-        output_dir = Path(settings.report_dir) / current_user["id"] / job_id
-        output_dir.mkdir(parents=True, exist_ok=True)
-
-        # Define callback for progress updates
-        async def update_callback(jid, status, progress, error=None, report_path=None):
-            async for db in get_db():
-                await update_job_status(db, jid, status, progress, error, report_path)
-
-        # Start background task
-        background_tasks.add_task(
-            run_generation_job,
+        # Hand the job to the worker queue
+        await enqueue_generation_job(
             job_id,
             upload["upload_path"],
             str(output_dir),
-            update_callback
+            _persist_job_update
         )
 
         return JobResponse(
@@ -294,7 +338,9 @@ async def get_job_status(
     current_user: dict = Depends(get_current_user)
 ):
     """Get job status."""
-    async for db in get_db():
+    from services.report_generator import get_job_progress
+
+    async with get_db() as db:
         job = await get_job(db, job_id)
 
         if not job:
@@ -319,7 +365,7 @@ async def get_job_status(
 @app.get("/api/jobs")
 async def list_jobs(current_user: dict = Depends(get_current_user)):
     """List user's jobs."""
-    async for db in get_db():
+    async with get_db() as db:
         jobs = await get_user_jobs(db, current_user["id"])
 
         return [
@@ -344,7 +390,7 @@ async def download_report(
     current_user: dict = Depends(get_current_user)
 ):
     """Download generated report."""
-    async for db in get_db():
+    async with get_db() as db:
         job = await get_job(db, job_id)
 
         if not job:
@@ -356,13 +402,14 @@ async def download_report(
         if job["status"] != "completed":
             raise HTTPException(status_code=400, detail="Report not ready")
 
-        if not job["report_path"] or not Path(job["report_path"]).exists():
+        if not job["report_path"] or not await asyncio.to_thread(Path(job["report_path"]).exists):
             raise HTTPException(status_code=404, detail="Report file not found")
 
         return FileResponse(
             job["report_path"],
             media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            filename="velvet_research_manuscript.docx"
+            filename="velvet_research_manuscript.docx",
+            headers={"Cache-Control": "private, max-age=300"}
         )
 
 
@@ -376,6 +423,12 @@ class FeedbackRequest(BaseModel):
     comments: Optional[List[str]] = None
 
 
+# Hoisted so both feedback endpoints bind the same string object and the
+# sqlite3 statement cache keys on it
+_SQL_INSERT_FEEDBACK = """INSERT INTO feedback (id, job_id, section, approved, comments, created_at)
+               VALUES (?, ?, ?, ?, ?, datetime('now'))"""
+
+
 @app.post("/api/feedback/{job_id}")
 async def submit_feedback(
     job_id: str,
@@ -383,7 +436,7 @@ async def submit_feedback(
     current_user: dict = Depends(get_current_user)
 ):
     """Submit section feedback (Phase 2)."""
-    async for db in get_db():
+    async with get_db() as db:
         job = await get_job(db, job_id)
 
         if not job:
@@ -393,26 +446,61 @@ async def submit_feedback(
             raise HTTPException(status_code=403, detail="Not authorized")
 
         # Store feedback
-        feedback_id = str(uuid.uuid4())
+        feedback_id = secrets.token_hex(16)
         await db.execute(
-            """INSERT INTO feedback (id, job_id, section, approved, comments, created_at)
-               VALUES (?, ?, ?, ?, ?, datetime('now'))""",
+            _SQL_INSERT_FEEDBACK,
             (feedback_id, job_id, feedback.section, 1 if feedback.approved else 0,
-             json.dumps(feedback.comments) if feedback.comments else None)
+             orjson.dumps(feedback.comments) if feedback.comments else None)
         )
         await db.commit()
 
         return {"status": "ok", "feedback_id": feedback_id}
 
 
+class FeedbackBatchRequest(BaseModel):
+    items: List[FeedbackRequest]
+
+
+@app.post("/api/feedback/{job_id}/batch")
+async def submit_feedback_batch(
+    job_id: str,
+    batch: FeedbackBatchRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Submit feedback for several sections in one transaction."""
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="No feedback items provided")
+
+    async with get_db() as db:
+        job = await get_job(db, job_id)
+
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+        if job["user_id"] != current_user["id"]:
+            raise HTTPException(status_code=403, detail="Not authorized")
+
+        # One executemany + one commit instead of a commit per section
+        rows = [
+            (secrets.token_hex(16), job_id, item.section, 1 if item.approved else 0,
+             orjson.dumps(item.comments) if item.comments else None)
+            for item in batch.items
+        ]
+        await db.executemany(_SQL_INSERT_FEEDBACK, rows)
+        await db.commit()
+
+        return {"status": "ok", "feedback_ids": [row[0] for row in rows]}
+
+
 @app.post("/api/regenerate/{job_id}")
 async def regenerate_report(
     job_id: str,
-    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user)
 ):
     """Regenerate report with feedback (Phase 2)."""
-    async for db in get_db():
+    from services.report_generator import enqueue_generation_job
+
+    async with get_db() as db:
         job = await get_job(db, job_id)
 
         if not job:
@@ -421,26 +509,22 @@ async def regenerate_report(
         if job["user_id"] != current_user["id"]:
             raise HTTPException(status_code=403, detail="Not authorized")
 
-        # Create new job
-        new_job_id = str(uuid.uuid4())
-        await create_job(db, new_job_id, current_user["id"], job["upload_id"])
-
-        # Get upload for path
-        upload = await get_upload(db, job["upload_id"])
+        # Create the new job and fetch the upload concurrently — they are
+        # independent, and aiosqlite serializes statements safely
+        new_job_id = secrets.token_hex(16)
+        _, upload = await asyncio.gather(
+            create_job(db, new_job_id, current_user["id"], job["upload_id"]),
+            get_upload(db, job["upload_id"])
+        )
 
         output_dir = Path(settings.report_dir) / current_user["id"] / new_job_id
         output_dir.mkdir(parents=True, exist_ok=True)
 
-        async def update_callback(jid, status, progress, error=None, report_path=None):
-            async for db in get_db():
-                await update_job_status(db, jid, status, progress, error, report_path)
-
-        background_tasks.add_task(
-            run_generation_job,
+        await enqueue_generation_job(
             new_job_id,
             upload["upload_path"],
             str(output_dir),
-            update_callback
+            _persist_job_update
         )
 
         return {"job_id": new_job_id, "status": "processing"}
@@ -475,7 +559,7 @@ class PurchaseResponse(BaseModel):
 @app.get("/api/tokens/balance", response_model=TokenBalanceResponse)
 async def get_token_balance(current_user: dict = Depends(get_current_user)):
     """Get user's token balance and transaction history."""
-    async for db in get_db():
+    async with get_db() as db:
         balance_data = await TokenManager.get_user_balance(db, current_user["id"])
         return TokenBalanceResponse(**balance_data)
 
@@ -493,7 +577,7 @@ async def purchase_tokens(
     current_user: dict = Depends(get_current_user)
 ):
     """Purchase token package."""
-    async for db in get_db():
+    async with get_db() as db:
         try:
             result = await TokenManager.purchase_tokens(
                 db, current_user["id"], request.package, request.payment_id
@@ -506,7 +590,7 @@ async def purchase_tokens(
 @app.get("/api/tokens/recommendations")
 async def get_token_recommendations(current_user: dict = Depends(get_current_user)):
     """Get token package recommendations."""
-    async for db in get_db():
+    async with get_db() as db:
         balance_data = await TokenManager.get_user_balance(db, current_user["id"])
         recommendations = TokenManager.get_package_recommendations(balance_data["balance"])
         return {"current_balance": balance_data["balance"], "recommendations": recommendations}
@@ -538,7 +622,7 @@ class InviteResponse(BaseModel):
 @app.post("/api/referral/generate", response_model=ReferralCodeResponse)
 async def generate_referral_code(current_user: dict = Depends(get_current_user)):
     """Generate or get existing referral code."""
-    async for db in get_db():
+    async with get_db() as db:
         referral_code = await ReferralManager.get_or_create_referral_code(db, current_user["id"])
         invitation_link = ReferralManager.format_referral_link(referral_code)
 
@@ -554,7 +638,7 @@ async def send_referral_invitation(
     current_user: dict = Depends(get_current_user)
 ):
     """Send referral invitation via email."""
-    async for db in get_db():
+    async with get_db() as db:
         result = await ReferralManager.send_invitation(db, current_user["id"], request.email)
         return InviteResponse(**result)
 
@@ -562,7 +646,7 @@ async def send_referral_invitation(
 @app.get("/api/referral/validate")
 async def validate_referral_code(ref: str):
     """Validate a referral code."""
-    async for db in get_db():
+    async with get_db() as db:
         validation = await ReferralManager.validate_referral_code(db, ref)
         return validation
 
@@ -570,7 +654,7 @@ async def validate_referral_code(ref: str):
 @app.get("/api/referral/stats")
 async def get_referral_stats(current_user: dict = Depends(get_current_user)):
     """Get user's referral statistics."""
-    async for db in get_db():
+    async with get_db() as db:
         stats = await ReferralManager.get_referral_stats(db, current_user["id"])
         return stats
 
@@ -586,7 +670,7 @@ class UserCreateWithReferral(UserCreate):
 @app.post("/api/auth/register_with_referral", response_model=TokenResponse)
 async def register_with_referral(user: UserCreateWithReferral):
     """Register new user with optional referral code."""
-    async for db in get_db():
+    async with get_db() as db:
         # Check if user exists
         existing = await get_user_by_email(db, user.email)
         if existing:
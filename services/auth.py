@@ -1,20 +1,44 @@
 """
 Velvet Research - Authentication Service
 """
-import uuid
+import os
+import time
+import asyncio
+import secrets
 from datetime import datetime, timedelta
 from typing import Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from cachetools import TTLCache
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr
 
 from config import settings
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Verified-token cache: progress-polling UIs present the same bearer
+# token every second, so skip the HMAC verification for a short window.
+# Entries are only added when the token outlives the cache window, so a
+# cached payload can never be served past its exp claim.
+_TOKEN_CACHE_TTL = 60
+_token_cache: TTLCache = TTLCache(maxsize=10000, ttl=_TOKEN_CACHE_TTL)
+
+# Password hashing context, built lazily so importing this module doesn't
+# pull in passlib/bcrypt before the first login/register
+_pwd_context = None
+
+
+def _get_pwd_context():
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__rounds=settings.bcrypt_rounds
+        )
+    return _pwd_context
+
 
 # JWT bearer
 security = HTTPBearer()
@@ -45,36 +69,109 @@ class TokenResponse(BaseModel):
 
 # Password utilities
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return _get_pwd_context().hash(password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return _get_pwd_context().verify(plain_password, hashed_password)
+
+
+# bcrypt holds the GIL, so a thread pool still serializes concurrent
+# logins on CPU — run hashing in worker processes instead
+_bcrypt_executor = None
+
+
+def _get_bcrypt_executor():
+    global _bcrypt_executor
+    if _bcrypt_executor is None:
+        from concurrent.futures import ProcessPoolExecutor
+        _bcrypt_executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _bcrypt_executor
+
+
+async def hash_password_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_bcrypt_executor(), hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_bcrypt_executor(), verify_password, plain_password, hashed_password
+    )
+
+
+# Hash used to equalize timing when the account doesn't exist
+_dummy_hash = None
+
+
+async def verify_against_dummy(password: str) -> bool:
+    """Burn a real bcrypt verification for unknown accounts.
+
+    Keeps failed logins for missing emails as slow as failed logins for
+    existing ones, so response timing doesn't leak which emails are
+    registered. Always returns False.
+    """
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = await hash_password_async("velvet-research-dummy-password")
+    await verify_password_async(password, _dummy_hash)
+    return False
+
+
+def shutdown_bcrypt_executor():
+    """Tear down the hashing process pool (called on app shutdown)."""
+    global _bcrypt_executor
+    if _bcrypt_executor is not None:
+        _bcrypt_executor.shutdown(wait=False)
+        _bcrypt_executor = None
+
+
+# JWT parameters bound once at import; settings is frozen, so reading
+# them through pydantic's attribute machinery on every token operation
+# was pure overhead. The secret is pre-encoded to bytes so the HMAC key
+# isn't re-derived from str on every encode/decode.
+_JWT_SECRET = settings.jwt_secret.encode()
+_JWT_ALG = settings.jwt_algorithm
+_JWT_EXP = timedelta(hours=settings.jwt_expiration_hours)
 
 
 # JWT utilities
 def create_access_token(user_id: str, email: str) -> str:
-    expire = datetime.utcnow() + timedelta(hours=settings.jwt_expiration_hours)
+    now = datetime.utcnow()
     payload = {
         "sub": user_id,
         "email": email,
-        "exp": expire,
-        "iat": datetime.utcnow()
+        "exp": now + _JWT_EXP,
+        "iat": now
     }
-    return jwt.encode(payload, settings.jwt_secret, algorithm=settings.jwt_algorithm)
+    return jwt.encode(payload, _JWT_SECRET, algorithm=_JWT_ALG)
 
 
 def decode_token(token: str) -> Optional[dict]:
+    payload = _token_cache.get(token)
+    if payload is not None:
+        return payload
+
     try:
         payload = jwt.decode(
             token,
-            settings.jwt_secret,
-            algorithms=[settings.jwt_algorithm]
+            _JWT_SECRET,
+            algorithms=[_JWT_ALG],
+            options={"require_exp": True}
         )
-        return payload
     except JWTError:
+        _token_cache.pop(token, None)
         return None
 
+    # time.time() is the epoch-seconds clock exp is expressed in;
+    # naive-datetime .timestamp() would read as local time and skew the
+    # margin by the UTC offset
+    exp = payload.get("exp")
+    if exp is not None and exp - time.time() > _TOKEN_CACHE_TTL:
+        _token_cache[token] = payload
+    return payload
+
 
 # Dependency for protected routes
 async def get_current_user(
@@ -97,4 +194,6 @@ async def get_current_user(
 
 
 def generate_user_id() -> str:
-    return str(uuid.uuid4())
+    # token_hex is cryptographically random without the UUID object
+    # construction/formatting overhead of uuid4
+    return secrets.token_hex(16)
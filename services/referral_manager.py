@@ -4,11 +4,15 @@ Handles referral code generation, invitations, and rewards
 """
 
 from typing import Dict, Optional
-import random
-import string
+import secrets
+from cachetools import TTLCache
 import database as db
 from services.token_manager import TokenManager
 
+# Validated referral codes change rarely — cache the validation payload
+# so landing-page checks don't hit the DB on every visit
+_referral_cache: TTLCache = TTLCache(maxsize=4096, ttl=300)
+
 
 class ReferralManager:
     REFERRAL_REWARD_TOKENS = 25
@@ -17,9 +21,10 @@ class ReferralManager:
     @staticmethod
     def generate_referral_code(user_id: str) -> str:
         """Generate a unique referral code for a user."""
-        # Format: VR-ABC123 (VR + first 3 chars of user_id + 3 random digits)
+        # Format: VR-ABC<10 hex chars> — 40 bits of randomness makes
+        # collisions a non-issue, no retry loop needed
         user_prefix = user_id[:3].upper().ljust(3, 'X')  # Ensure at least 3 chars
-        random_suffix = str(random.randint(100, 999))
+        random_suffix = secrets.token_hex(5).upper()
         return f"VR-{user_prefix}{random_suffix}"
 
     @staticmethod
@@ -30,21 +35,10 @@ class ReferralManager:
         if existing:
             return existing["referral_code"]
 
-        # Generate new code
+        # With 40 bits of entropy the UNIQUE constraint (and ON CONFLICT
+        # DO NOTHING in create_referral) covers the theoretical collision
+        # without the old SELECT-and-retry loop
         referral_code = ReferralManager.generate_referral_code(user_id)
-
-        # Ensure uniqueness
-        max_attempts = 10
-        attempt = 0
-        while attempt < max_attempts:
-            existing_code = await db.get_referral_by_code(database, referral_code)
-            if not existing_code:
-                break
-            # Try again with new random suffix
-            referral_code = ReferralManager.generate_referral_code(user_id)
-            attempt += 1
-
-        # Create the referral record
         await db.create_referral(database, user_id, referral_code)
 
         return referral_code
@@ -100,24 +94,28 @@ The Velvet Research Team
     @staticmethod
     async def validate_referral_code(database, referral_code: str) -> Dict:
         """Validate a referral code and return referrer information."""
-        referral = await db.get_referral_by_code(database, referral_code)
+        cached = _referral_cache.get(referral_code)
+        if cached is not None:
+            return cached
+
+        # Single JOIN pulls the referral and referrer together
+        referral = await db.get_referral_with_referrer(database, referral_code)
 
         if not referral:
             return {"valid": False, "message": "Invalid referral code"}
 
-        # Get referrer information
-        referrer = await db.get_user_by_id(database, referral["referrer_user_id"])
-
-        return {
+        result = {
             "valid": True,
             "referral_code": referral_code,
             "referrer": {
-                "id": referrer["id"],
-                "email": referrer["email"].split("@")[0] + "@***"  # Partial email for privacy
+                "id": referral["referrer_user_id"],
+                "email": referral["referrer_email"].split("@")[0] + "@***"  # Partial email for privacy
             },
             "discount_percent": ReferralManager.REFEREE_DISCOUNT_PERCENT,
             "reward_tokens": ReferralManager.REFERRAL_REWARD_TOKENS
         }
+        _referral_cache[referral_code] = result
+        return result
 
     @staticmethod
     async def apply_referral_discount(package_price: int) -> int:
@@ -130,6 +128,7 @@ The Velvet Research Team
         """Process referral signup and record the connection."""
         try:
             await db.record_referral_signup(database, referral_code, referee_user_id)
+            _referral_cache.pop(referral_code, None)
             return True
         except Exception as e:
             print(f"Error processing referral signup: {e}")
@@ -140,6 +139,7 @@ The Velvet Research Team
         """Award referral tokens when referee makes their first purchase."""
         try:
             success = await db.award_referral_tokens(database, referral_code)
+            _referral_cache.pop(referral_code, None)
 
             if success:
                 return {
@@ -3,6 +3,8 @@ Token Management Service
 Handles token operations, pricing, and consumption logic
 """
 
+import bisect
+from functools import lru_cache
 from typing import Dict, List, Optional
 import database as db
 
@@ -52,21 +54,21 @@ class TokenManager:
         """Estimate token cost for a project based on complexity."""
         tokens_needed = TokenManager.TOKEN_REQUIREMENTS.get(complexity, 200)
 
-        # Recommend best package
+        # Smallest covering package via bisect over the presorted sizes
+        index = bisect.bisect_left(_PACKAGE_TOKEN_STEPS, tokens_needed)
         best_package = None
-        for package_name, package_info in TokenManager.TOKEN_PACKAGES.items():
-            if package_info["tokens"] >= tokens_needed:
-                best_package = {
-                    "name": package_name,
-                    "tokens": package_info["tokens"],
-                    "price": package_info["price"],
-                    "remaining_after_project": package_info["tokens"] - tokens_needed
-                }
-                break
+        if index < len(_PACKAGES_BY_TOKENS):
+            tokens, name, price = _PACKAGES_BY_TOKENS[index]
+            best_package = {
+                "name": name,
+                "tokens": tokens,
+                "price": price,
+                "remaining_after_project": tokens - tokens_needed
+            }
 
         return {
             "tokens_needed": tokens_needed,
-            "estimated_value": f"${tokens_needed * 0.99:.0f}",
+            "estimated_value": _ESTIMATED_VALUES[tokens_needed],
             "recommended_package": best_package,
             "all_packages": TokenManager.TOKEN_PACKAGES
         }
@@ -135,29 +137,54 @@ class TokenManager:
     @staticmethod
     def get_package_recommendations(current_balance: int) -> List[Dict]:
         """Get package recommendations based on current balance."""
-        recommendations = []
-
-        for package_name, package_info in TokenManager.TOKEN_PACKAGES.items():
-            value_per_dollar = package_info["tokens"] / package_info["price"]
-
-            recommendation = {
-                "name": package_name,
-                "tokens": package_info["tokens"],
-                "price": package_info["price"],
-                "value_per_dollar": round(value_per_dollar, 2),
-                "projects_enabled": []
-            }
-
-            # Calculate what projects this would enable
-            total_tokens = current_balance + package_info["tokens"]
-            for project_type, tokens_needed in TokenManager.TOKEN_REQUIREMENTS.items():
-                projects_possible = total_tokens // tokens_needed
-                if projects_possible > 0:
-                    recommendation["projects_enabled"].append({
-                        "type": project_type,
-                        "count": projects_possible
-                    })
-
-            recommendations.append(recommendation)
-
-        return recommendations
\ No newline at end of file
+        cached = _recommendations_for_bucket(current_balance // _BALANCE_BUCKET)
+        # Shallow-copy so callers can't mutate the cached entries
+        return [
+            {**rec, "projects_enabled": [dict(p) for p in rec["projects_enabled"]]}
+            for rec in cached
+        ]
+
+
+# The per-package facts (name, tokens, price, value per dollar) are
+# static — derive them once at import instead of on every request
+_PACKAGE_BASE = tuple(
+    {
+        "name": name,
+        "tokens": info["tokens"],
+        "price": info["price"],
+        "value_per_dollar": round(info["tokens"] / info["price"], 2),
+    }
+    for name, info in TokenManager.TOKEN_PACKAGES.items()
+)
+
+# Packages sorted by size so cost estimation bisects to the smallest
+# one that covers a project, and the estimated dollar value is formatted
+# once per requirement tier instead of per request
+_PACKAGES_BY_TOKENS = tuple(sorted(
+    (info["tokens"], name, info["price"])
+    for name, info in TokenManager.TOKEN_PACKAGES.items()
+))
+_PACKAGE_TOKEN_STEPS = tuple(p[0] for p in _PACKAGES_BY_TOKENS)
+_ESTIMATED_VALUES = {
+    tokens: f"${tokens * 0.99:.0f}"
+    for tokens in TokenManager.TOKEN_REQUIREMENTS.values()
+}
+
+# Recommendations only shift meaningfully as the balance crosses package
+# thresholds, so cache them per 50-token bucket rather than per balance
+_BALANCE_BUCKET = 50
+
+
+@lru_cache(maxsize=256)
+def _recommendations_for_bucket(bucket: int) -> tuple:
+    balance = bucket * _BALANCE_BUCKET
+    recommendations = []
+    for base in _PACKAGE_BASE:
+        total_tokens = balance + base["tokens"]
+        projects_enabled = tuple(
+            {"type": project_type, "count": total_tokens // tokens_needed}
+            for project_type, tokens_needed in TokenManager.TOKEN_REQUIREMENTS.items()
+            if total_tokens >= tokens_needed
+        )
+        recommendations.append({**base, "projects_enabled": projects_enabled})
+    return tuple(recommendations)
\ No newline at end of file
@@ -4,6 +4,7 @@ Velvet Research - File Upload Service
 import os
 import uuid
 import json
+import asyncio
 import aiofiles
 from pathlib import Path
 from datetime import datetime
@@ -12,6 +13,39 @@ from fastapi import UploadFile, HTTPException
 
 from config import settings
 
+# Streaming chunk size for writing uploads to disk
+_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+# Size limits in bytes, computed once (settings is frozen)
+_MAX_FILE_BYTES = settings.max_file_size_mb << 20
+_MAX_TOTAL_BYTES = settings.max_upload_size_mb << 20
+
+# Files at least this large get evicted from the page cache after the
+# write — a big upload otherwise pushes out hotter pages (SQLite, code)
+# on the small Render instance. The file is read back at most once, at
+# generation time.
+_FADVISE_THRESHOLD = 16 << 20
+
+
+def _drop_page_cache(path: str):
+    """Advise the kernel to evict a written file (runs in a thread —
+    fadvise on dirty pages can block on writeback)."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(path: str):
+    """Flush a directory's entries to disk (runs in a thread — a
+    directory fsync stalls for the device flush)."""
+    dfd = os.open(path, os.O_DIRECTORY)
+    try:
+        os.fsync(dfd)
+    finally:
+        os.close(dfd)
+
 
 async def save_uploaded_files(
     user_id: str,
@@ -27,43 +61,65 @@ async def save_uploaded_files(
     timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
     upload_path = Path(settings.upload_dir) / user_id / f"{timestamp}_{upload_id}"
 
-    # Create directory
-    upload_path.mkdir(parents=True, exist_ok=True)
+    # Create directory — one makedirs call with the final mode instead
+    # of mkdir-then-chmod; uploads aren't world-readable
+    os.makedirs(upload_path, mode=0o750, exist_ok=True)
 
     file_list = []
     total_size = 0
 
     for file in files:
-        # Validate extension
-        ext = Path(file.filename).suffix.lower()
+        # Validate extension. rfind on the name skips constructing a
+        # Path (and its parsing) per file just to read the suffix
+        name = file.filename
+        dot = name.rfind('.')
+        ext = name[dot:].lower() if dot > 0 else ''
         if ext not in settings.allowed_extensions:
             raise HTTPException(
                 status_code=400,
                 detail=f"File type {ext} not allowed. Allowed: {settings.allowed_extensions}"
             )
 
-        # Read content
-        content = await file.read()
-        file_size = len(content)
-        total_size += file_size
-
-        # Check size limits
-        if file_size > settings.max_file_size_mb * 1024 * 1024:
+        # Fail fast when Starlette already knows the size (multipart
+        # Content-Length) — no point writing a single chunk of a file
+        # that can't be accepted
+        if file.size is not None and file.size > _MAX_FILE_BYTES:
             raise HTTPException(
                 status_code=400,
                 detail=f"File {file.filename} exceeds {settings.max_file_size_mb}MB limit"
             )
 
-        if total_size > settings.max_upload_size_mb * 1024 * 1024:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Total upload exceeds {settings.max_upload_size_mb}MB limit"
-            )
-
-        # Save file
+        # Stream to disk in 1 MiB chunks — peak memory per upload stays
+        # at one chunk instead of the whole file, and oversized uploads
+        # are rejected mid-transfer rather than after buffering them
         file_path = upload_path / file.filename
-        async with aiofiles.open(file_path, 'wb') as f:
-            await f.write(content)
+        file_size = 0
+        try:
+            async with aiofiles.open(file_path, 'wb') as f:
+                while chunk := await file.read(_CHUNK_SIZE):
+                    file_size += len(chunk)
+                    total_size += len(chunk)
+
+                    if file_size > _MAX_FILE_BYTES:
+                        raise HTTPException(
+                            status_code=400,
+                            detail=f"File {file.filename} exceeds {settings.max_file_size_mb}MB limit"
+                        )
+
+                    if total_size > _MAX_TOTAL_BYTES:
+                        raise HTTPException(
+                            status_code=400,
+                            detail=f"Total upload exceeds {settings.max_upload_size_mb}MB limit"
+                        )
+
+                    await f.write(chunk)
+        except HTTPException:
+            # Don't leave a truncated file behind
+            file_path.unlink(missing_ok=True)
+            raise
+
+        if file_size >= _FADVISE_THRESHOLD and hasattr(os, 'posix_fadvise'):
+            await asyncio.to_thread(_drop_page_cache, str(file_path))
 
         file_list.append({
             "name": file.filename,
@@ -72,30 +128,47 @@ async def save_uploaded_files(
             "path": str(file_path)
         })
 
+    # One directory fsync after the whole batch makes every new entry
+    # durable in a single flush, instead of syncing per file
+    if hasattr(os, 'O_DIRECTORY'):
+        await asyncio.to_thread(_fsync_dir, str(upload_path))
+
     return upload_id, str(upload_path), file_list
 
 
 def get_upload_files(upload_path: str) -> List[dict]:
     """Get list of files in upload directory."""
-    path = Path(upload_path)
-    if not path.exists():
+    # scandir serves name/path/stat from the directory read itself —
+    # iterdir + Path.stat() re-statted every entry
+    try:
+        with os.scandir(upload_path) as entries:
+            return [
+                {
+                    "name": entry.name,
+                    "size": entry.stat().st_size,
+                    "type": os.path.splitext(entry.name)[1].lower(),
+                    "path": entry.path
+                }
+                for entry in entries
+                if entry.is_file()
+            ]
+    except FileNotFoundError:
         return []
 
-    files = []
-    for f in path.iterdir():
-        if f.is_file():
-            files.append({
-                "name": f.name,
-                "size": f.stat().st_size,
-                "type": f.suffix.lower(),
-                "path": str(f)
-            })
-    return files
-
 
 def cleanup_upload(upload_path: str):
     """Remove upload directory and files."""
-    import shutil
-    path = Path(upload_path)
-    if path.exists():
-        shutil.rmtree(path)
+    # Upload dirs are flat (save_uploaded_files writes straight into
+    # them), so a scandir + unlink loop skips rmtree's recursive stat
+    # walk. rmtree stays as the fallback if something nested a
+    # directory in there.
+    try:
+        with os.scandir(upload_path) as entries:
+            for entry in entries:
+                os.unlink(entry.path)
+        os.rmdir(upload_path)
+    except FileNotFoundError:
+        pass
+    except (IsADirectoryError, PermissionError, OSError):
+        import shutil
+        shutil.rmtree(upload_path, ignore_errors=True)